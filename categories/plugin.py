@@ -5,19 +5,53 @@ An MkDocs plugin allowing for categorization of pages in your wiki.
 from __future__ import annotations
 
 import logging
+import os
+import posixpath
 import re
 import shutil
+import threading
 import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import count
 from logging import Logger, getLogger
+from operator import itemgetter
 from pathlib import Path
 
-from natsort import natsorted
+import yaml
 from mkdocs.config import config_options
 from mkdocs.plugins import BasePlugin
 from mkdocs.structure.files import File
 from mkdocs.structure.pages import Page
 from mkdocs.utils import get_markdown_title, get_relative_url, meta
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_SLUG_STRIP = str.maketrans('', '', ''.join(
+    c for c in map(chr, range(128)) if not (c.isalnum() or c.isspace() or c in '-_')
+))
+_SLUG_DASH = re.compile(r'[-\s]+')
+_YAML_START = re.compile(r'-{3}[ \t]*\n')
+_YAML_END = re.compile(r'^(?:-{3}|\.{3})[ \t]*\n', re.MULTILINE)
+_MULTIMARKDOWN_KEY = re.compile(r'[ ]{0,3}[A-Za-z0-9_-]+:')
+_BLANK_LINE = re.compile(r'\n[ \t]*\n')
+_DIGITS = re.compile(r'(\d+)')
+_WRITE_BUFFER = 1 << 16
+_HEAD_SIZE = 4096
+_stale_ids = count()
+_IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+def natural_key(text: str) -> list:
+    """Returns a key for natural sorting, comparing the numbers in a string by
+    their value so that "Book 2" sorts before "Book 10". Like natsort, the text
+    is compared in its decomposed form."""
+    parts = _DIGITS.split(unicodedata.normalize('NFD', text))
+    parts[1::2] = map(int, parts[1::2])
+    return parts
 
 def get_page_title(page_src: str, meta_data: dict) -> str:
     """Returns the title of the page. The title in the meta data section
@@ -28,12 +62,96 @@ def get_page_title(page_src: str, meta_data: dict) -> str:
         else get_markdown_title(page_src) or ''
     )
 
-def slugify(title: str) -> str:
-    """Returns the path slug used for the category URL.
+def get_meta_data(source: str) -> tuple[str, dict]:
+    """Returns the markdown source and meta data of a page. YAML front matter
+    is parsed directly from its own block, only MultiMarkdown style meta data is
+    left to MkDocs' parser, which splits and rejoins the entire page."""
+    start = _YAML_START.match(source)
+    if not start:
+        if _MULTIMARKDOWN_KEY.match(source):
+            return meta.get_data(source)
+        return source, {}
+    # The block holds at least one line, just like MkDocs requires
+    end = _YAML_END.search(source, start.end() + 1)
+    if not end:
+        return source, {}
+    try:
+        meta_data = yaml.load(source[start.end():end.start()], Loader=SafeLoader)
+    except Exception:  # pylint: disable=broad-exception-caught
+        # Invalid front matter means no meta data, same as in MkDocs
+        return source, {}
+    if not isinstance(meta_data, dict):
+        return source, {}
+    return source[end.end():].lstrip('\n'), meta_data
+
+def write_page(path: str, content: str) -> None:
+    """Writes a generated markdown page."""
+    Path(path).write_text(content, encoding='utf-8')
+
+def meta_ends_within(head: bytes) -> bool:
+    """Returns whether the meta data block of a page, if it has one, ends within
+    the given leading bytes of the page."""
+    text = head.decode('utf-8', 'ignore').replace('\r\n', '\n').replace('\r', '\n')
+    start = _YAML_START.match(text)
+    if start:
+        return _YAML_END.search(text, start.end() + 1) is not None
+    # MultiMarkdown meta data ends no later than the first blank line
+    return not _MULTIMARKDOWN_KEY.match(text) or _BLANK_LINE.search(text) is not None
+
+def parse_page(path: str) -> tuple[str, dict]:
+    """Reads a documentation page and returns its title and meta data. The title
+    is only looked up for pages that define categories."""
+    with open(path, 'rb') as handle:
+        raw = handle.read(_HEAD_SIZE)
+        # Meta data sits at the top of the page. When the head holds all of it
+        # and never mentions categories, the rest of the page is not read.
+        if b'categories' not in raw.lower() and meta_ends_within(raw):
+            return '', {}
+        raw += handle.read()
+    # Most pages never mention categories, so a byte scan lets them skip the
+    # decoding and meta data parsing. MultiMarkdown style keys ignore case.
+    if b'categories' not in raw.lower():
+        return '', {}
+    source = raw.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    source, meta_data = get_meta_data(source)
+    if 'categories' not in meta_data:
+        return '', meta_data
+    return get_page_title(source, meta_data), meta_data
+
+def read_page(file: File, cache: dict) -> tuple[File, tuple, str, dict]:
+    """Returns a documentation page along with its modification stamp, title and
+    meta data. Pages that did not change since they were cached are not read."""
+    stat = os.stat(file.abs_src_path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = cache.get(file.abs_src_path)
+    if cached and cached[0] == stamp:
+        return (file, *cached)
+    return (file, stamp, *parse_page(file.abs_src_path))
+
+@lru_cache(maxsize=4096)
+def slugify(title: str, allow_unicode: bool = False) -> str:
+    """Returns the path slug used for the category URL. Unless allow_unicode is
+    set, titles are folded to ASCII. Otherwise letters, digits, and combining
+    marks of any script are kept. Results are cached since the same category
+    keys are slugified repeatedly during a build.
     Adapted from django.utils.text"""
-    slug = unicodedata.normalize('NFKD', str(title)).encode('ascii', 'ignore').decode('ascii')
-    slug = re.sub(r'[^\w\s-]', '', slug).strip().lower()
-    return re.sub(r'[-\s]+', '-', slug)
+    slug = str(title)
+    if slug.isascii():
+        slug = slug.translate(_SLUG_STRIP)
+    elif allow_unicode:
+        # The quick check avoids building a new string for already normalized titles
+        if not unicodedata.is_normalized('NFKC', slug):
+            slug = unicodedata.normalize('NFKC', slug)
+        # Combining marks are kept as well, they are part of the letters in
+        # scripts such as Devanagari
+        slug = ''.join(
+            c for c in slug
+            if unicodedata.category(c)[0] in 'LNM' or c in '-_' or c.isspace()
+        )
+    else:
+        slug = unicodedata.normalize('NFKD', slug).encode('ascii', 'ignore').decode('ascii')
+        slug = slug.translate(_SLUG_STRIP)
+    return _SLUG_DASH.sub('-', slug.strip().lower())
 
 class CategoriesPlugin(BasePlugin):
     """
@@ -47,28 +165,74 @@ class CategoriesPlugin(BasePlugin):
         ('section_title', config_options.Type(str, default='Categories')),
         ('category_separator', config_options.Type(str, default='|')),
         ('debug_fs', config_options.Type(bool, default=False)),
+        ('parallel_io', config_options.Type(bool, default=True)),
+        ('unicode_slugs', config_options.Type(bool, default=False)),
     )
     log: Logger = getLogger(f'mkdocs.plugins.{__name__}')
-    categories: dict = {}
-    pages:dict = {}
+    categories: dict
+    pages: dict
+    sorted_pages: dict
+    link_blocks: dict
+    meta_cache: dict
     cat_path: Path = Path()
+    section_header: str = ''
+
+    def __init__(self):
+        # Mutable state lives on the instance, class level dicts would be shared
+        # by every instance and outlive the plugin that filled them
+        super().__init__()
+        self.categories = {}
+        self.pages = defaultdict(set)
+        self.sorted_pages = {}
+        self.link_blocks = {}
+        self.meta_cache = {}
+
+    def on_startup(self, **_):
+        """Executed once when MkDocs starts. Implementing this hook makes MkDocs
+        keep the plugin instance across the rebuilds of `mkdocs serve`, so the
+        meta data of unchanged pages is not read and parsed again."""
+        self.meta_cache = {}
 
     def on_config(self, _):
-        """Set the log level if the verbose config option is set"""
+        """Set the log level if the verbose config option is set and prepare the
+        state for a new build."""
         self.log.setLevel(
             logging.INFO if self.config['verbose'] else logging.WARNING
         )
+        # Every build starts from fresh state, nothing from a previous build in
+        # the same process may leak into this one
+        self.categories = {}
+        self.pages = defaultdict(set)
+        self.sorted_pages = {}
+        self.link_blocks = {}
         self.cat_path = Path(self.config['base_name'])
+        self.section_header = f"\n## {self.config['section_title']}\n\n"
         if self.cat_path.exists():
             self.clean_temp_dir()
         self.cat_path.mkdir(parents=True)
 
     def clean_temp_dir(self):
-        """Remove the temporary directory after execution."""
+        """Remove the temporary directory after execution. The directory is moved
+        aside and deleted in the background, so a new one can be created right
+        away."""
         if self.config['debug_fs']:
             self.log.info("Debugging: Not removing temporary directory.")
             return
-        shutil.rmtree(self.cat_path)
+        stale_path = self.cat_path.with_name(
+            f"{self.cat_path.name}.stale-{os.getpid()}-{next(_stale_ids)}"
+        )
+        try:
+            os.replace(self.cat_path, stale_path)
+        except OSError:
+            shutil.rmtree(self.cat_path)
+            return
+        # Not a daemon thread, so the interpreter waits for it before exiting and
+        # never leaves the stale directory behind
+        threading.Thread(target=shutil.rmtree, args=(stale_path,)).start()
+
+    def io_workers(self) -> int:
+        """Returns the number of threads used to read and write pages."""
+        return _IO_WORKERS if self.config['parallel_io'] else 1
 
     def on_nav(self, nav, /, **_):
         """
@@ -78,8 +242,9 @@ class CategoriesPlugin(BasePlugin):
         """
         if not self.config['no_nav']:
             return nav
+        base_name = self.config['base_name']
         for item in nav:
-            if item.is_section and str(item.title).lower() == self.config['base_name']:
+            if item.is_section and str(item.title).lower() == base_name:
                 nav.items.remove(item)
                 break
         return nav
@@ -88,6 +253,8 @@ class CategoriesPlugin(BasePlugin):
         """Executed after the build has failed."""
         self.categories.clear()
         self.pages.clear()
+        self.sorted_pages.clear()
+        self.link_blocks.clear()
         self.clean_temp_dir()
 
     def on_post_build(self, **_):
@@ -95,51 +262,59 @@ class CategoriesPlugin(BasePlugin):
         self.log.info("Defined %s categories.", len(self.categories))
         self.categories.clear()
         self.pages.clear()
+        self.sorted_pages.clear()
+        self.link_blocks.clear()
         self.clean_temp_dir()
 
     def on_page_markdown(self, markdown: str, /, *, page: Page, **_):
         """Appends the category links section for a page to the markdown."""
-        relative_url = get_relative_url(str(self.cat_path), page.file.src_uri)
-        if page.file.src_uri not in self.pages:
+        page_categories = self.sorted_pages.get(page.file.src_uri)
+        if page_categories is None:
             return markdown
-        links = list(map(
-            lambda c: (
-                f"- [{self.categories[c]['name']}]"
-                f"({relative_url}/{self.categories[c]['slug']}.md)"
-            ),
-            natsorted(self.pages[page.file.src_uri])
-        ))
-        return (
-            markdown +
-            f"\n## {self.config['section_title']}\n\n" +
-            "\n".join(links)
-        )
+        # The section only depends on the page's categories and the directory it
+        # is in, so pages sharing both share the rendered section
+        block_key = (posixpath.dirname(page.file.src_uri), page_categories)
+        block = self.link_blocks.get(block_key)
+        if block is None:
+            relative_url = get_relative_url(str(self.cat_path), page.file.src_uri)
+            cats = self.categories
+            block = self.section_header + "\n".join(
+                f"- [{cats[c]['name']}]({relative_url}/{cats[c]['slug']}.md)"
+                for c in page_categories
+            )
+            self.link_blocks[block_key] = block
+        return markdown + block
 
     def ensure_path(self, cat_path: list[str]) -> dict|None:
         """Ensure that the category path exists and return the last category."""
         if len(cat_path) <= 0:
             return None
         result = {}
-        for i, cat_name in enumerate(cat_path):
-            cat_key = '-'.join(cat_path[:i + 1])
+        parent_key = None
+        for cat_name in cat_path:
+            # Each key extends its parent's key, so the lineage is built once
+            cat_key = cat_name if parent_key is None else f"{parent_key}-{cat_name}"
             if cat_key not in self.categories:
-                slugified = slugify(cat_key)
+                slugified = slugify(cat_key, self.config['unicode_slugs'])
                 self.categories[cat_key] = {
-                    'name':     cat_name,
-                    'key':      cat_key,
-                    'slug':     slugify(cat_key),
-                    'pages':    [],
-                    'parent':   '-'.join(cat_path[:i]) if i > 0 else None,
-                    'children': [],
+                    'name':       cat_name,
+                    'key':        cat_key,
+                    'slug':       slugified,
+                    'sort_key':   natural_key(cat_name),
+                    'pages':      [],
+                    'parent_ref': result or None,
+                    'children':   {},
                 }
                 self.log.info(
                     'Defined new category "%s" with slug "%s"',
-                    cat_path[i],
+                    cat_name,
                     slugified
                 )
-            if len(result) > 0 and cat_key not in result['children']:
-                result['children'].append(cat_key)
+            if len(result) > 0:
+                # Children are kept as the keys of a dict: an ordered set
+                result['children'][cat_key] = None
             result = self.categories[cat_key]
+            parent_key = cat_key
         return result
 
     def register_page(self, cat_path: list[str], page_url: str, page_title: str) -> None:
@@ -152,47 +327,61 @@ class CategoriesPlugin(BasePlugin):
         })
 
         # Each page also stores which categories it belongs to
-        if page_url not in self.pages:
-            self.pages[page_url] = set()
         self.pages[page_url].add(category['key'])
 
+    def read_pages(self, docs: list[File], cache: dict):
+        """Yields the result of read_page for each documentation page, in order.
+        The pages are read concurrently unless a single worker is enough."""
+        read = partial(read_page, cache=cache)
+        workers = min(self.io_workers(), len(docs))
+        if workers <= 1:
+            yield from map(read, docs)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(read, docs)
+
     def define_categories(self, files) -> None:
         """Read all of the meta data and define any categories."""
-        for file in filter(lambda f: f.is_documentation_page(), files):
-            with open(file.abs_src_path, encoding='utf-8') as handle:
-                source, meta_data = meta.get_data(handle.read())
-                if len(meta_data) <= 0 or 'categories' not in meta_data:
-                    continue
-                if not isinstance(meta_data['categories'], list):
-                    self.log.error(
-                        'The categories object at %s was not a list, but %s',
-                        str(file.src_path),
-                        type(meta_data['categories'].__name__)
-                    )
-                    continue
-                for category in meta_data['categories']:
-                    self.register_page(
-                        str(category).split(self.config['category_separator']),
-                        str(file.src_path),
-                        get_page_title(source, meta_data)
-                    )
+        docs = [file for file in files if file.is_documentation_page()]
+        register_page = self.register_page
+        cat_sep = self.config['category_separator']
+        # Only pages that still exist are kept in the cache for the next build
+        previous, self.meta_cache = self.meta_cache, {}
+        # Pages are registered on this thread in their original order so the
+        # result does not depend on the scheduling of the reads
+        for file, stamp, page_title, meta_data in self.read_pages(docs, previous):
+            self.meta_cache[file.abs_src_path] = (stamp, page_title, meta_data)
+            if len(meta_data) <= 0 or 'categories' not in meta_data:
+                continue
+            if not isinstance(meta_data['categories'], list):
+                self.log.error(
+                    'The categories object at %s was not a list, but %s',
+                    str(file.src_path),
+                    type(meta_data['categories'].__name__)
+                )
+                continue
+            # The path is the same for each of the page's categories
+            page_url = str(file.src_path)
+            for category in meta_data['categories']:
+                register_page(str(category).split(cat_sep), page_url, page_title)
 
     def generate_index(self, config) -> File:
         """Generates a categories index page if the option is set."""
-        joined = "\n".join(map(
-            lambda c: f"- [{c['name']}](./{str(c['slug'])}.md) ({len(c['pages'])})",
-            natsorted(self.categories.values(), key=lambda c: c['name'])
-        ))
-        with open(self.cat_path / 'index.md', mode="w", encoding='utf-8') as file:
+        with open(
+            self.cat_path / 'index.md', mode="w", encoding='utf-8', buffering=_WRITE_BUFFER
+        ) as file:
             file.write(
                 "# All Categories\n\n"
                 "\n"
                 f"There are a total of {len(self.categories.keys())} categories(s):\n"
                 "\n"
-                f"{joined}\n"
+            )
+            file.writelines(
+                f"- [{c['name']}](./{str(c['slug'])}.md) ({len(c['pages'])})\n"
+                for c in sorted(self.categories.values(), key=itemgetter('sort_key'))
             )
         return File(
-            path               = str(self.cat_path / 'index.md'),
+            path               = f"{self.cat_path.as_posix()}/index.md",
             src_dir            = str(self.cat_path.parent),
             dest_dir           = config['site_dir'],
             use_directory_urls = True
@@ -209,55 +398,81 @@ class CategoriesPlugin(BasePlugin):
         """Renders the child categories of a category."""
         if len(category['children']) <= 0:
             return False, None
-        joined = "\n".join(map(
-            lambda c: f"- [{self.categories[c]['name']}](./{self.categories[c]['slug']}.md)",
-            natsorted(category['children'])
-        ))
+        cats = self.categories
+        joined = "\n".join(
+            f"- [{cats[c]['name']}](./{cats[c]['slug']}.md)"
+            for c in sorted(category['children'], key=lambda c: cats[c]['sort_key'])
+        )
         return True, joined
 
     def render_category_pages(self, category: dict) -> tuple[bool, str]:
         """Renders the pages of a category."""
         if len(category['pages']) <= 0:
             return False, None
-        joined = "\n".join(map(
-            lambda p: f"- [{p['title']}](../{p['url']})",
-            natsorted(category['pages'], key=lambda p: p['title'])
-        ))
+        joined = "\n".join(
+            f"- [{p['title']}](../{p['url']})"
+            for p in sorted(category['pages'], key=lambda p: natural_key(p['title']))
+        )
         return True, joined
 
     def render_parent_category(self, category: dict) -> str:
         """Renders the parent category of a category."""
-        if not category['parent']:
+        parent = category['parent_ref']
+        if not parent:
             return None
-        parent = self.categories[category['parent']]
         return f"[{parent['name']}](./{parent['slug']}.md)"
 
+    def render_category(self, category: dict, all_categories_link: str) -> str:
+        """Renders the markdown page of a category."""
+        (has_pages, pages) = self.render_category_pages(category)
+        (has_children, children) = self.render_child_categories(category)
+        parent = self.render_parent_category(category)
+
+        parts = [f"# Category: {category['name']}\n\n"]
+        if parent:
+            parts.append(f"Parent category: {parent}\n\n")
+        if has_children:
+            parts.append(f"## Subcategories\n\n{children}\n\n")
+        parts.append(f"## Pages in category \"{category['name']}\"\n\n")
+        parts.append(f"{pages if has_pages else 'This category has no pages.'}\n\n")
+        parts.append(all_categories_link)
+        return ''.join(parts)
+
     def on_files(self, files, /, *, config, **_):
         """When MkDocs loads its files, load any defined categories."""
         self.define_categories(files)
+        # MkDocs expects POSIX style paths for the files it is handed
+        base_uri = self.cat_path.as_posix()
+        cat_dir = str(self.cat_path)
+        parent_dir = str(self.cat_path.parent)
+        site_dir = config['site_dir']
+        all_categories_link = self.render_all_categories_link()
+        # Distinct categories can share a slug, keyed by file name the last one
+        # wins like it would when writing the pages one after another
+        pending = {}
         for category in self.categories.values():
-            file_name = f"{category['slug']}.md"
-            (has_pages, pages) = self.render_category_pages(category)
-            (has_children, children) = self.render_child_categories(category)
-            parent = self.render_parent_category(category)
-
-            with open(self.cat_path / file_name, mode="w", encoding='utf-8') as file:
-                file.write(''.join([
-                    f"# Category: {category['name']}\n\n",
-                    (f"Parent category: {parent}\n\n" if parent else ''),
-                    (f"## Subcategories\n\n{children}\n\n" if has_children else ''),
-                    f"## Pages in category \"{category['name']}\"\n\n",
-                    f"{pages if has_pages else 'This category has no pages.'}\n\n",
-                    self.render_all_categories_link(),
-                ]))
-
-            outfile = File(
-                path               = str(Path(self.config['base_name']) / file_name),
-                src_dir            = str(self.cat_path.parent),
-                dest_dir           = config['site_dir'],
-                use_directory_urls = True
+            pending[f"{category['slug']}.md"] = self.render_category(
+                category, all_categories_link
             )
-            files.append(outfile)
+        for file_name in pending:
+            files.append(File(
+                path               = f"{base_uri}/{file_name}",
+                src_dir            = parent_dir,
+                dest_dir           = site_dir,
+                use_directory_urls = True
+            ))
+        # Every category page is a separate file, so they are written concurrently
+        with ThreadPoolExecutor(max_workers=self.io_workers()) as pool:
+            list(pool.map(
+                write_page,
+                [os.path.join(cat_dir, file_name) for file_name in pending],
+                pending.values()
+            ))
         if self.config['generate_index']:
             files.append(self.generate_index(config))
+        # The categories of each page are final now, sort them once for all of
+        # the page hooks that follow
+        self.sorted_pages = {
+            url: tuple(sorted(keys, key=natural_key)) for url, keys in self.pages.items()
+        }
         return files
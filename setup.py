@@ -20,7 +20,7 @@ setup(
     python_requires='>=3.10',
     install_requires=[
         'mkdocs',
-        'natsort>=8.4.0'
+        'pyyaml'
     ],
     classifiers=[
         'License :: OSI Approved :: MIT License',